@@ -4,63 +4,177 @@ Flask Video -> Frames PDF (Render-ready)
 Features:
 - Paste a YouTube link OR upload a local video file.
 - Preview video in the browser (YouTube iframe for youtube links, HTML5 <video> for direct links/ uploads).
-- Server-side: downloads the video (yt-dlp), extracts unique frames using OpenCV + SSIM, converts frames to a single PDF with timestamps (FPDF).
+- Server-side: downloads the video (yt-dlp), extracts unique frames using PyAV/OpenCV (dHash gate, pixel difference for borderline frames), converts frames to a single PDF with timestamps (ReportLab).
 - Designed to be deployed to Render using Gunicorn. Optional Dockerfile included if you need ffmpeg.
 - IMPORTANT: long-running processing may exceed HTTP timeouts on some hosts. For Render, use a longer gunicorn timeout (example provided).
 """
 
 import os
 import re
+import sys
+import json
+import time
+import heapq
+import itertools
 import uuid
+import queue
 import shutil
-import tempfile
 import threading
+import subprocess
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
-from flask import Flask, request, jsonify, send_file, url_for, render_template
+from urllib.parse import urlparse
+from flask import Flask, request, jsonify, send_from_directory, url_for, render_template
 from werkzeug.utils import secure_filename
 
 # Third-party libs
 import yt_dlp
 import cv2
-from skimage.metrics import structural_similarity as ssim
-from fpdf import FPDF
-from PIL import Image
+import numpy as np
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
+
+try:
+    import av
+except ImportError:  # optional: extract_unique_frames() falls back to cv2.VideoCapture
+    av = None
+
+try:
+    import numba
+except ImportError:  # optional: select_unique() falls back to plain NumPy
+    numba = None
 
 # Configuration
-UPLOAD_FOLDER = "/tmp/video_to_pdf_uploads"
 RESULTS_FOLDER = "/tmp/video_to_pdf_results"
-ALLOWED_EXTENSIONS = {"mp4", "mov", "mkv", "webm", "avi", "ogv"}
+ALLOWED_EXTENSIONS = frozenset({"mp4", "mov", "mkv", "webm", "avi", "ogv"})
 MAX_CONTENT_LENGTH = 300 * 1024 * 1024  # 300 MB
+SANITIZE_RE = re.compile(r'[\\/:*?"<>|]+')
+TASK_ID_RE = re.compile(r"[0-9a-f]{32}")  # uuid4().hex
+
+# Frame de-duplication: a 64-bit dHash decides most frames, a thumbnail mean-abs-diff settles the ambiguous band
+HASH_SIZE = (9, 8)  # 9x8 thumbnail -> 8x8 horizontal gradients -> 64 bits
+HASH_SKIP_BITS = 2  # distance <= this: same slide, skip
+HASH_SAVE_BITS = 10  # distance > this: new slide, save
+DIFF_THRESHOLD = 2.0  # in between: save if the thumbnails differ by more than this on average (0-255)
+THUMB_SIZE = (160, 90)
+SEEK_MIN_STRIDE = 60  # sample strides at or above this seek to each frame instead of grabbing through
+DECODE_WORKERS = os.cpu_count() or 1
+MIN_SEGMENT_FRAMES = 1500  # don't split videos into segments shorter than ~1 min at 25 fps
+LABEL_REGION = np.s_[5:20, 5:65]  # pixels under the PDF timestamp label, probed to pick its colour
+HWACCEL = os.environ.get("HWACCEL", "auto")  # "auto", "none" or an FFmpeg device type such as "cuda"
+HWACCEL_DEVICES = ("cuda", "videotoolbox", "vaapi", "qsv", "d3d11va")  # tried in this order by "auto"
+USE_OPENCL = os.environ.get("OPENCL", "auto") != "none" and cv2.ocl.haveOpenCL()  # OpenCV Transparent API for the cv2 path
+STREAM_QUEUE_SIZE = 16  # decoded frames buffered between the stream decoder and the filter (~45 MB at 720p)
+LUMA_FORMATS = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12", "nv21", "gray"}  # 8-bit, luma in plane 0
+MAX_DOWNLOAD_HEIGHT = 480  # yt-dlp format cap; slides stay legible and decode cost scales with pixel count
+MAX_FRAME_WIDTH = 960  # kept frames wider than this are downscaled before JPEG encoding
+JPEG_QUALITY = 85  # frames are kept in memory as JPEG until the PDF is built
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+# Background jobs: RQ when REDIS_URL is set (workers must share RESULTS_FOLDER), otherwise an in-process pool
+REDIS_URL = os.environ.get("REDIS_URL")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_TIMEOUT = 30 * 60
+STATUS_FILE = "status.json"
+
+CLEANUP_INTERVAL = 60  # seconds between sweeps for expired task dirs
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
+cv2.ocl.setUseOpenCL(USE_OPENCL)
+rl_config.useA85 = 0  # embed JPEG bytes raw instead of ASCII85 (+25%)
+
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+# behind a proxy that honours X-Sendfile (Apache mod_xsendfile, lighttpd), let it serve the PDFs
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE") == "1"
+
+if REDIS_URL:
+    from redis import Redis
+    from rq import Queue
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError
+    rq_queue = Queue("video_to_pdf", connection=Redis.from_url(REDIS_URL))
+    job_pool = None
+else:
+    rq_queue = None
+    job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+
+cleanup_heap = []
+cleanup_lock = threading.Lock()
+cleanup_thread = None
 
 # Helpers
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def sanitize_filename(s: str) -> str:
-    return secure_filename(re.sub(r"[\\\\/:*?\"<>|]+", "-", s).strip("."))
+    return secure_filename(SANITIZE_RE.sub("-", s).strip("."))
+
+def _cleanup_worker():
+    while True:
+        time.sleep(CLEANUP_INTERVAL)
+        now = time.time()
+        with cleanup_lock:
+            due = []
+            while cleanup_heap and cleanup_heap[0][0] <= now:
+                due.append(heapq.heappop(cleanup_heap)[1])
+        for path in due:
+            shutil.rmtree(path, ignore_errors=True)
 
 def start_cleanup(path: str, delay_seconds: int = 3600):
-    def _cleanup():
-        try:
-            threading.Event().wait(delay_seconds)
-            if os.path.exists(path):
-                shutil.rmtree(path)
-        except Exception:
-            pass
-    t = threading.Thread(target=_cleanup, daemon=True)
-    t.start()
-
-def download_video_with_yt_dlp(url: str, outdir: str, prefer_mp4: bool = True, max_retries: int = 3) -> str:
+    # one shared daemon thread drains a min-heap of (expiry, path) instead of a sleeping thread per task;
+    # started lazily so it lives in the process (e.g. forked gunicorn worker) that schedules work
+    global cleanup_thread
+    with cleanup_lock:
+        heapq.heappush(cleanup_heap, (time.time() + delay_seconds, path))
+        if cleanup_thread is None:
+            cleanup_thread = threading.Thread(target=_cleanup_worker, daemon=True)
+            cleanup_thread.start()
+
+def write_status(task_dir: str, **status):
+    # status.json lives next to the results so every gunicorn worker (and RQ worker) sees it
+    tmp_path = os.path.join(task_dir, STATUS_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, os.path.join(task_dir, STATUS_FILE))
+
+def read_status(task_dir: str):
+    try:
+        with open(os.path.join(task_dir, STATUS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def yt_dlp_format(prefer_mp4: bool = True, max_height=MAX_DOWNLOAD_HEIGHT) -> str:
+    # video-only formats first: the audio track is never used
+    cap = f"[height<={max_height}]" if max_height else ""
+    ext = "[ext=mp4]" if prefer_mp4 else ""
+    # H.264 first: bestvideo alone often picks AV1, which OpenCV's FFmpeg build can't decode
+    avc = "[vcodec^=avc1]"
+    choices = [f"bestvideo{cap}{ext}{avc}", f"best{cap}{ext}{avc}", f"bestvideo{cap}{ext}", f"best{cap}{ext}", f"best{cap}", "best"]
+    return "/".join(dict.fromkeys(choices))
+
+def clear_task_dir(task_dir: str, keep=()):
+    # /tmp is RAM-backed on Render: drop the (possibly large) source video as soon as the job
+    # settles instead of an hour later, keeping only the status and the deliverable
+    for name in os.listdir(task_dir):
+        if name == STATUS_FILE or name in keep:
+            continue
+        path = os.path.join(task_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+def download_video_with_yt_dlp(url: str, outdir: str, prefer_mp4: bool = True, max_height=MAX_DOWNLOAD_HEIGHT, max_retries: int = 3) -> str:
     Path(outdir).mkdir(parents=True, exist_ok=True)
     outtmpl = os.path.join(outdir, "video.%(ext)s")
-    format_pref = "best[ext=mp4]/best" if prefer_mp4 else "best"
+    format_pref = yt_dlp_format(prefer_mp4, max_height)
     ydl_opts = {"format": format_pref, "outtmpl": outtmpl, "noplaylist": True, "quiet": True}
     last_exc = None
     for attempt in range(1, max_retries+1):
@@ -86,84 +200,453 @@ def get_video_title(url: str) -> str:
     except Exception:
         return sanitize_filename(url)[:60]
 
-def extract_unique_frames(video_path: str, frames_out: str, sample_rate: int = 3, ssim_threshold: float = 0.80, max_frames: int = 50):
-    Path(frames_out).mkdir(parents=True, exist_ok=True)
-    cap = cv2.VideoCapture(video_path)
+def dhash(small) -> int:
+    thumb = cv2.resize(small, HASH_SIZE, interpolation=cv2.INTER_AREA)
+    bits = thumb[:, 1:] > thumb[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def frame_differs(frame_hash: int, small, last_hash, last_small, diff_threshold: float) -> bool:
+    if last_hash is None:
+        return True
+    dist = (frame_hash ^ last_hash).bit_count()
+    if dist > HASH_SAVE_BITS:
+        return True
+    if dist <= HASH_SKIP_BITS:
+        return False
+    return cv2.absdiff(small, last_small).mean() > diff_threshold
+
+def _select_unique_numpy(hashes, thumbs, diff_threshold: float, max_frames: int):
+    # hashes: (M,) uint64, thumbs: (M, H, W) uint8, both in frame order.
+    # Same decisions as frame_differs() frame by frame, but every remaining frame's hash is
+    # compared against the last kept one in a single vectorized step; the thumbnail diff is
+    # only computed for frames in the ambiguous band ahead of the first certain save.
+    if len(hashes) == 0 or max_frames < 1:
+        return np.empty(0, np.int64)
+    keep = [0]
+    last = 0
+    while len(keep) < max_frames and last + 1 < len(hashes):
+        xor = np.bitwise_xor(hashes[last + 1:], hashes[last])
+        dist = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+        saves = np.flatnonzero(dist > HASH_SAVE_BITS)
+        end = int(saves[0]) if saves.size else len(dist)
+        band = np.flatnonzero(dist[:end] > HASH_SKIP_BITS)
+        if band.size:
+            mad = np.abs(thumbs[last + 1 + band].astype(np.int16) - thumbs[last]).mean(axis=(1, 2))
+            hits = band[mad > diff_threshold]
+            if hits.size:
+                end = int(hits[0])
+        if end == len(dist):
+            break
+        last += 1 + end
+        keep.append(last)
+    return np.array(keep)
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True, error_model="numpy")
+    def _select_unique_jit(hashes, thumbs, diff_threshold, max_frames):
+        # Frame-by-frame version of _select_unique_numpy(); compiled, it never allocates
+        # and the pixel loop is auto-vectorized.
+        count, height, width = thumbs.shape
+        if count == 0 or max_frames < 1:
+            return np.empty(0, np.int64)
+        keep = np.empty(min(count, max_frames), np.int64)
+        keep[0] = 0
+        kept = 1
+        last = 0
+        limit = diff_threshold * height * width
+        for i in range(1, count):
+            if kept >= max_frames:
+                break
+            xor = hashes[i] ^ hashes[last]
+            dist = 0
+            while xor:
+                xor &= xor - np.uint64(1)
+                dist += 1
+            if dist <= HASH_SKIP_BITS:
+                continue
+            if dist <= HASH_SAVE_BITS:
+                total = 0
+                for y in range(height):
+                    for x in range(width):
+                        total += abs(np.int16(thumbs[i, y, x]) - np.int16(thumbs[last, y, x]))
+                if total <= limit:
+                    continue
+            keep[kept] = i
+            kept += 1
+            last = i
+        return keep[:kept]
+
+def select_unique(hashes, thumbs, diff_threshold: float, max_frames: int):
+    if numba is not None:
+        return _select_unique_jit(hashes, thumbs, diff_threshold, max_frames)
+    return _select_unique_numpy(hashes, thumbs, diff_threshold, max_frames)
+
+def iter_sampled_frames(cap, sample_rate: int, start: int = 0, stop=None, seekable: bool = True):
+    # grab() demuxes/decodes without the BGR conversion, so skipped frames are cheap;
+    # for wide strides a seek (which restarts at the nearest keyframe) beats decoding every frame
+    # stop=None reads to EOF: CAP_PROP_FRAME_COUNT is only an estimate (a guess on a pipe)
+    if seekable and sample_rate >= SEEK_MIN_STRIDE:
+        # a seek past the last frame leaves nothing to read, which ends an open-ended run
+        indices = range(start, stop, sample_rate) if stop is not None else itertools.count(start, sample_rate)
+        for frame_idx in indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame_idx, frame
+        return
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_idx = start
+    while (stop is None or frame_idx < stop) and cap.grab():
+        if frame_idx % sample_rate == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                return
+            yield frame_idx, frame
+        frame_idx += 1
+
+def frame_gray(frame, out=None):
+    if isinstance(frame, np.ndarray):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+    # PyAV frame: the luma plane already is the gray image
+    if frame.format.name in LUMA_FORMATS:
+        plane = frame.planes[0]
+        # zero-copy view; rows are padded to line_size
+        luma = np.frombuffer(plane, np.uint8, count=plane.line_size * frame.height)
+        return luma.reshape(frame.height, plane.line_size)[:, :frame.width]
+    return frame.to_ndarray(format="gray")
+
+def frame_bgr(frame, max_width=None):
+    if isinstance(frame, np.ndarray):
+        height, width = frame.shape[:2]
+        if max_width and width > max_width:
+            size = (max_width, round(height * max_width / width))
+            return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return frame
+    if max_width and frame.width > max_width:
+        # swscale does the downscale and the YUV->BGR conversion in one pass
+        height = round(frame.height * max_width / frame.width)
+        return frame.to_ndarray(width=max_width, height=height, format="bgr24")
+    return frame.to_ndarray(format="bgr24")
+
+def filter_frames(frames, fps: float, diff_threshold: float, max_frames: int, max_width=None):
+    # frames: iterable of (frame_idx, frame) in order; frame is a BGR array or a PyAV VideoFrame.
+    # Returns the frames that are unique within the run, JPEG-encoded in memory.
+    candidates = []
+    last_hash = None
+    last_small = None
+    # scratch buffers reused for every sampled frame; only kept thumbnails are copied out
+    gray_buf = None
+    small_buf = np.empty((THUMB_SIZE[1], THUMB_SIZE[0]), np.uint8)
+    for frame_idx, frame in frames:
+        if USE_OPENCL and isinstance(frame, np.ndarray):
+            # T-API: conversion and downscale run on the OpenCL device, only the thumbnail comes back
+            ugray = cv2.cvtColor(cv2.UMat(frame), cv2.COLOR_BGR2GRAY)
+            small_buf[...] = cv2.resize(ugray, THUMB_SIZE, interpolation=cv2.INTER_AREA).get()
+            gray = None
+        else:
+            gray = frame_gray(frame, gray_buf)
+            if isinstance(frame, np.ndarray):
+                gray_buf = gray
+            cv2.resize(gray, THUMB_SIZE, dst=small_buf, interpolation=cv2.INTER_AREA)
+        frame_hash = dhash(small_buf)
+        if not frame_differs(frame_hash, small_buf, last_hash, last_small, diff_threshold):
+            continue
+        small = small_buf.copy()
+        timestamp = int(frame_idx / fps)
+        ok, jpeg = cv2.imencode(".jpg", frame_bgr(frame, max_width), JPEG_PARAMS)
+        if not ok:
+            raise RuntimeError(f"Could not encode frame {frame_idx}.")
+        label = gray[LABEL_REGION] if gray is not None else frame_gray(frame[LABEL_REGION])
+        corner_mean = int(label.mean())
+        candidates.append((jpeg.tobytes(), timestamp, corner_mean, frame_hash, small))
+        last_hash = frame_hash
+        last_small = small
+        if len(candidates) >= max_frames:
+            break
+    return candidates
+
+def merge_candidates(runs, diff_threshold: float, max_frames: int):
+    # each run only knew its own history; re-run the filter across the seams
+    candidates = [c for run in runs for c in run]
+    if not candidates:
+        return []
+    hashes = np.array([c[3] for c in candidates], dtype=np.uint64)
+    thumbs = np.stack([c[4] for c in candidates])
+    keep = select_unique(hashes, thumbs, diff_threshold, max_frames)
+    return [candidates[i][:3] for i in keep]
+
+def open_capture(video_path: str):
+    # VIDEO_ACCELERATION_ANY quietly decodes in software when no device (or no support in this build) is found
+    if HWACCEL != "none":
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(video_path)
+
+def scan_segment(video_path: str, start: int, stop, sample_rate: int, diff_threshold: float, max_frames: int, max_width=None):
+    # Runs on a worker thread with its own capture; OpenCV releases the GIL while decoding.
+    cap = open_capture(video_path)
     if not cap.isOpened():
         raise RuntimeError("Cannot open video file.")
     fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
-    frame_idx = 0
-    saved = []
-    last_small = None
-    ssim_size = (160, 90)
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame_idx % sample_rate != 0:
-            frame_idx += 1
-            continue
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        small = cv2.resize(gray, ssim_size, interpolation=cv2.INTER_AREA)
-        should_save = False
-        if last_small is None:
-            should_save = True
-        else:
+    try:
+        return filter_frames(iter_sampled_frames(cap, sample_rate, start, stop), fps, diff_threshold, max_frames, max_width)
+    finally:
+        cap.release()
+
+failed_hwaccels = set()
+
+def hwaccel_candidates():
+    # PyAV hardware devices to try, best first, always ending with None (software decode)
+    if HWACCEL == "none":
+        return [None]
+    try:
+        from av.codec.hwaccel import hwdevices_available
+    except ImportError:  # PyAV < 14
+        return [None]
+    wanted = HWACCEL_DEVICES if HWACCEL == "auto" else (HWACCEL,)
+    available = set(hwdevices_available())
+    return [d for d in wanted if d in available and d not in failed_hwaccels] + [None]
+
+def scan_av(video_path: str, sample_rate: int, diff_threshold: float, max_frames: int, max_width=None, hwaccel=None):
+    # FFmpeg frame/slice threading spreads the decode over all cores, and frames come out as
+    # YUV: skipped frames are never converted and sampled ones only up to the luma plane.
+    options = {}
+    if hwaccel is not None:
+        from av.codec.hwaccel import HWAccel
+        options["hwaccel"] = HWAccel(device_type=hwaccel, allow_software_fallback=True)
+    with av.open(video_path, **options) as container:
+        if not container.streams.video:
+            raise RuntimeError("Cannot open video file.")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        fps = float(stream.average_rate or 25.0)
+        frames = ((i, f) for i, f in enumerate(container.decode(stream)) if i % sample_rate == 0)
+        return filter_frames(frames, fps, diff_threshold, max_frames, max_width)
+
+def split_segments(total: int, sample_rate: int):
+    if total <= 0:
+        return [(0, None)]
+    count = max(1, min(DECODE_WORKERS, total // MIN_SEGMENT_FRAMES))
+    # boundaries on multiples of sample_rate keep the sampled frame indices identical to a single pass
+    step = -(-total // count // sample_rate) * sample_rate
+    segments = [(start, min(start + step, total)) for start in range(0, total, step)]
+    # the total is an estimate, so the last segment runs to EOF rather than stopping at it
+    segments[-1] = (segments[-1][0], None)
+    return segments
+
+def extract_unique_frames(video_path: str, sample_rate: int = 3, diff_threshold: float = DIFF_THRESHOLD, max_frames: int = 50, max_width=MAX_FRAME_WIDTH):
+    if av is not None:
+        errored = []
+        for hwaccel in hwaccel_candidates():
             try:
-                sim = ssim(small, last_small, data_range=small.max() - small.min())
-            except Exception:
-                sim = 0.0
-            if sim < ssim_threshold:
-                should_save = True
-        if should_save:
-            timestamp = int(frame_idx / fps)
-            out_name = f"frame_{frame_idx:06d}_{timestamp}s.png"
-            out_path = os.path.join(frames_out, out_name)
-            cv2.imwrite(out_path, frame)
-            saved.append((out_name, timestamp))
-            last_small = small
-            if len(saved) >= max_frames:
-                break
-        frame_idx += 1
+                candidates = scan_av(video_path, sample_rate, diff_threshold, max_frames, max_width, hwaccel)
+            except av.error.FFmpegError:
+                errored.append(hwaccel)
+                continue
+            # the file itself decodes, so the devices that errored are unusable on this host
+            failed_hwaccels.update(d for d in errored if d is not None)
+            return [c[:3] for c in candidates]
+        # let OpenCV have a go
+    cap = open_capture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError("Cannot open video file.")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
-    return saved
+    segments = split_segments(total, sample_rate)
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        futures = [pool.submit(scan_segment, video_path, start, stop, sample_rate, diff_threshold, max_frames, max_width)
+                   for start, stop in segments]
+        results = [f.result() for f in futures]
+    return merge_candidates(results, diff_threshold, max_frames)
+
+def stream_unique_frames(url: str, workdir: str, sample_rate: int = 3, diff_threshold: float = DIFF_THRESHOLD, max_frames: int = 50, max_width=MAX_FRAME_WIDTH, prefer_mp4: bool = True, max_height=MAX_DOWNLOAD_HEIGHT):
+    # Decodes while yt-dlp is still downloading: yt-dlp writes to stdout, a pump thread copies
+    # that into a FIFO opened by OpenCV, and a decoder thread feeds sampled frames through a
+    # bounded queue, so a slow filter stalls the download instead of buffering it in memory.
+    # Returns None when the stream can't be decoded (e.g. moov atom at the end of the MP4),
+    # so the caller can fall back to a full download.
+    if not hasattr(os, "mkfifo"):
+        return None
+    fifo = os.path.join(workdir, "stream.fifo")
+    os.mkfifo(fifo)
+    format_pref = yt_dlp_format(prefer_mp4, max_height)
+    cmd = [sys.executable, "-m", "yt_dlp", "-f", format_pref, "--no-playlist", "--quiet", "-o", "-", "--", url]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def _pump():
+        try:
+            with open(fifo, "wb") as out:
+                shutil.copyfileobj(proc.stdout, out)
+        except OSError:
+            pass  # reader went away
+
+    def _release_pump():
+        # a pump still blocked in open(fifo, "wb") needs a reader to come and go; its next
+        # write then fails with EPIPE and the thread exits
+        for _ in range(10):
+            if not pump.is_alive():
+                return
+            try:
+                os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            pump.join(timeout=0.5)
+
+    pump = threading.Thread(target=_pump, daemon=True)
+    cap = None
+    frames = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
 
-def convert_frames_to_pdf(frames_dir: str, out_pdf_path: str):
-    files = sorted([f for f in os.listdir(frames_dir) if f.lower().endswith((".png", ".jpg", ".jpeg"))])
-    if not files:
+    def _put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def _decode():
+        try:
+            for item in iter_sampled_frames(cap, sample_rate, seekable=False):
+                _put(item)
+                if stop.is_set():
+                    return
+        except Exception as e:
+            _put(e)
+        finally:
+            _put(None)
+
+    def _drain():
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    decoder = threading.Thread(target=_decode, daemon=True)
+    try:
+        # a failing yt-dlp (bad or private URL, network error, bot check) exits without writing
+        # anything; OpenCV must never be pointed at a FIFO that no writer will ever open
+        if not proc.stdout.peek(1):
+            return None
+        pump.start()
+        # FFmpeg backend only: falling through to other backends would reopen the FIFO after
+        # the pump has closed it and block in open() forever
+        cap = cv2.VideoCapture(fifo, cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        decoder.start()
+        candidates = filter_frames(_drain(), fps, diff_threshold, max_frames, max_width)
+        return [c[:3] for c in candidates] or None
+    finally:
+        stop.set()
+        proc.kill()
+        proc.wait()
+        if decoder.is_alive():
+            decoder.join()
+        if cap is not None:
+            cap.release()
+        _release_pump()
+        os.remove(fifo)
+
+def format_timestamp(seconds: int) -> str:
+    minutes, secs = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+
+def convert_frames_to_pdf(frames, out_pdf_path: str):
+    # frames: (jpeg_bytes, seconds, corner_mean) tuples as returned by extract_unique_frames()
+    if not frames:
         raise RuntimeError("No frames found.")
-    pdf = FPDF(orientation='L')
-    pdf.set_auto_page_break(False)
-    for fname in files:
-        fpath = os.path.join(frames_dir, fname)
-        pdf.add_page()
-        pdf.image(fpath, x=0, y=0, w=pdf.w, h=pdf.h)
-        # derive timestamp
-        m = re.search(r"_(\\d+)s", fname)
-        seconds = int(m.group(1)) if m else 0
-        ts = f"{seconds//3600:02d}:{(seconds%3600)//60:02d}:{seconds%60:02d}"
-        # contrast check
-        img = Image.open(fpath).convert('L')
-        region = img.crop((5,5,65,20)).resize((1,1))
-        mean = region.getpixel((0,0))
-        pdf.set_text_color(255,255,255 if mean<64 else 0)
-        pdf.set_xy(5,5)
-        pdf.set_font('Helvetica', size=12)
-        pdf.cell(0,0,ts)
-    pdf.output(out_pdf_path)
+    # ReportLab embeds the JPEGs as-is (DCTDecode) and writes straight to the output file
+    page_w, page_h = landscape(A4)
+    pdf = canvas.Canvas(out_pdf_path, pagesize=(page_w, page_h))
+    for jpeg, seconds, corner_mean in frames:
+        pdf.drawImage(ImageReader(BytesIO(jpeg)), 0, 0, width=page_w, height=page_h)
+        shade = 1 if corner_mean<64 else 0
+        pdf.setFillColorRGB(shade, shade, shade)
+        pdf.setFont('Helvetica', 12)
+        pdf.drawString(6*mm, page_h - 6.5*mm, format_timestamp(seconds))
+        pdf.showPage()
+    pdf.save()
     return out_pdf_path
 
+def run_task(task_id: str, params: dict):
+    # Runs on the job pool or an RQ worker; the outcome is reported through status.json
+    task_dir = os.path.join(RESULTS_FOLDER, task_id)
+    sample_rate = params["sample_rate"]
+    diff_thr = params["diff_threshold"]
+    max_frames = params["max_frames"]
+    # hi_res keeps the source resolution for both the download and the PDF pages
+    hi_res = params.get("hi_res", False)
+    max_width = None if hi_res else MAX_FRAME_WIDTH
+    max_height = None if hi_res else MAX_DOWNLOAD_HEIGHT
+    try:
+        write_status(task_dir, status="running", started_at=time.time())
+        video_url = params.get("video_url")
+        if video_url:
+            title = get_video_title(video_url)
+            # decode while downloading; fall back to a full download into task_dir
+            saved = stream_unique_frames(video_url, task_dir, sample_rate=sample_rate, diff_threshold=diff_thr, max_frames=max_frames, max_width=max_width, max_height=max_height)
+            if saved is None:
+                video_path = download_video_with_yt_dlp(video_url, task_dir, max_height=max_height)
+                saved = extract_unique_frames(video_path, sample_rate=sample_rate, diff_threshold=diff_thr, max_frames=max_frames, max_width=max_width)
+        else:
+            title = params["title"]
+            saved = extract_unique_frames(params["video_path"], sample_rate=sample_rate, diff_threshold=diff_thr, max_frames=max_frames, max_width=max_width)
+
+        if not saved:
+            raise RuntimeError("No distinctive frames found. Try lowering the change threshold or increasing max frames.")
+
+        pdf_name = f"{sanitize_filename(title)}_{task_id}.pdf"
+        pdf_path = os.path.join(task_dir, pdf_name)
+        convert_frames_to_pdf(saved, pdf_path)
+        clear_task_dir(task_dir, keep=(pdf_name,))
+        write_status(task_dir, status="done", pdf_name=pdf_name)
+    except Exception as e:
+        clear_task_dir(task_dir)
+        write_status(task_dir, status="error", error=str(e))
+    finally:
+        # the hour-long download window starts once the job has settled
+        start_cleanup(task_dir, delay_seconds=60*60)
+
+def submit_task(task_id: str, params: dict):
+    if rq_queue is not None:
+        rq_queue.enqueue(run_task, task_id, params, job_id=task_id, job_timeout=JOB_TIMEOUT, result_ttl=0, failure_ttl=60*60)
+    else:
+        job_pool.submit(run_task, task_id, params)
+
+def rq_job_failed(task_id: str) -> bool:
+    # a job killed by RQ (timeout, crashed work horse) never gets to write its own status
+    try:
+        job = Job.fetch(task_id, connection=rq_queue.connection)
+    except NoSuchJobError:
+        return False
+    return job.is_failed or job.is_stopped or job.is_canceled
+
 # Routes
 @app.route("/")
 def home():
-    return render_template("index.html")
+    return render_template("index.html", job_timeout=JOB_TIMEOUT)
 
 @app.route("/process", methods=["POST"])
 def process():
     # parameters
-    sample_rate = int(request.form.get("sample_rate", 3))
-    ssim_thr = float(request.form.get("ssim", 0.80))
-    max_frames = int(request.form.get("max_frames", 40))
+    try:
+        params = {
+            "sample_rate": max(1, int(request.form.get("sample_rate", 3))),
+            "diff_threshold": max(0.0, float(request.form.get("diff", DIFF_THRESHOLD))),
+            "max_frames": max(1, int(request.form.get("max_frames", 40))),
+            "hi_res": request.form.get("hi_res") in ("1", "on", "true"),
+        }
+    except ValueError:
+        return jsonify({"error":"Invalid sample rate, change threshold or max frames."}), 400
 
     video_url = request.form.get("video_url")
     upload = request.files.get("video_file")
@@ -175,44 +658,57 @@ def process():
     try:
         if upload and upload.filename:
             if not allowed_file(upload.filename):
+                shutil.rmtree(task_dir, ignore_errors=True)
                 return jsonify({"error":"Unsupported file type."}), 400
             filename = sanitize_filename(upload.filename)
             video_path = os.path.join(task_dir, filename)
             upload.save(video_path)
-            title = os.path.splitext(filename)[0]
+            params["video_path"] = video_path
+            params["title"] = os.path.splitext(filename)[0]
         elif video_url:
-            title = get_video_title(video_url)
-            # download to task_dir
-            video_path = download_video_with_yt_dlp(video_url, task_dir)
+            if urlparse(video_url).scheme not in ("http", "https"):
+                shutil.rmtree(task_dir, ignore_errors=True)
+                return jsonify({"error":"Only http(s) video URLs are supported."}), 400
+            params["video_url"] = video_url
         else:
+            shutil.rmtree(task_dir, ignore_errors=True)
             return jsonify({"error":"No video provided."}), 400
 
-        frames_dir = os.path.join(task_dir, "frames")
-        os.makedirs(frames_dir, exist_ok=True)
-        saved = extract_unique_frames(video_path, frames_dir, sample_rate=sample_rate, ssim_threshold=ssim_thr, max_frames=max_frames)
-        if not saved:
-            return jsonify({"error":"No distinctive frames found. Try lowering SSIM threshold or increasing max frames."}), 400
+        write_status(task_dir, status="queued")
+        submit_task(task_id, params)
 
-        pdf_name = f"{sanitize_filename(title)}_{task_id}.pdf"
-        pdf_path = os.path.join(task_dir, pdf_name)
-        convert_frames_to_pdf(frames_dir, pdf_path)
-
-        # schedule cleanup
-        start_cleanup(task_dir, delay_seconds=60*60)
-
-        download_url = url_for("download", task_id=task_id, filename=pdf_name, _external=True)
-        return jsonify({"status":"done", "download_url":download_url})
+        status_url = url_for("status", task_id=task_id)
+        return jsonify({"status":"queued", "task_id":task_id, "status_url":status_url}), 202
     except Exception as e:
         shutil.rmtree(task_dir, ignore_errors=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/status/<task_id>")
+def status(task_id):
+    if not TASK_ID_RE.fullmatch(task_id):
+        return jsonify({"error":"Unknown task."}), 404
+    state = read_status(os.path.join(RESULTS_FOLDER, task_id))
+    if state is None:
+        return jsonify({"error":"Unknown task."}), 404
+    if state["status"] in ("queued", "running") and rq_queue is not None and rq_job_failed(task_id):
+        state = {"status":"error", "error":"Processing failed or timed out."}
+    # pool threads can't be killed, so in-process jobs past the deadline are reported as failed
+    if state["status"] == "running" and time.time() > state.get("started_at", 0) + JOB_TIMEOUT:
+        state = {"status":"error", "error":"Processing timed out."}
+    if state["status"] == "done":
+        state["download_url"] = url_for("download", task_id=task_id, filename=state.pop("pdf_name"))
+    return jsonify(state)
+
 @app.route("/download/<task_id>/<path:filename>")
 def download(task_id, filename):
+    if not TASK_ID_RE.fullmatch(task_id):
+        return "Not found", 404
     safe_dir = os.path.join(RESULTS_FOLDER, task_id)
-    fpath = os.path.join(safe_dir, filename)
-    if not os.path.exists(fpath):
+    if not os.path.exists(os.path.join(safe_dir, filename)):
         return "Not found", 404
-    return send_file(fpath, as_attachment=True)
+    # conditional: ETag/Last-Modified + Range support, so re-downloads and resumes are cheap;
+    # the file handle goes to wsgi.file_wrapper (or the proxy with USE_X_SENDFILE)
+    return send_from_directory(safe_dir, filename, as_attachment=True, conditional=True, max_age=3600)
 
 if __name__ == "__main__":
     # For local dev: use Flask's server